@@ -10,6 +10,8 @@ import pytz
 
 # Import from local utils
 from utils.time_checker import within_crawl_window, get_crawl_window_info
+from utils.price_changes import read_changes, last_cursor
+from utils.retry_queue import load_retry_queue, job_retry_queue_path
 
 app = FastAPI(title="Pick n Pay Scraper API", version="1.0.0")
 
@@ -29,6 +31,13 @@ class ScrapeStatus(BaseModel):
 # In-memory storage for scrape status
 scrape_jobs = {}
 
+def running_job():
+    """Return the id of a scrape job that is still running, if any"""
+    for task_id, job in scrape_jobs.items():
+        if job["status"] == "running":
+            return task_id
+    return None
+
 @app.get("/")
 async def root():
     return {
@@ -38,6 +47,8 @@ async def root():
             "status": "/scrape/status",
             "start_scraping": "/scrape/start (POST)",
             "get_results": "/scrape/results",
+            "get_changes": "/scrape/changes?since=<cursor>&wait=<seconds>",
+            "retry_failed": "/scrape/jobs/{task_id}/retry (POST)",
             "docs": "/docs"
         }
     }
@@ -66,6 +77,11 @@ async def start_scrape(background_tasks: BackgroundTasks):
             detail=f"Scraping not allowed: {message}"
         )
     
+    # Concurrent runs would write products.json and the change log at the same time
+    busy = running_job()
+    if busy:
+        raise HTTPException(status_code=409, detail=f"Scrape job {busy} is still running")
+    
     task_id = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     scrape_jobs[task_id] = {
@@ -90,6 +106,51 @@ async def get_job_status(task_id: str):
         raise HTTPException(status_code=404, detail="Job not found")
     return scrape_jobs[task_id]
 
+@app.post("/scrape/jobs/{task_id}/retry", response_model=ScrapeResponse)
+async def retry_job(task_id: str, background_tasks: BackgroundTasks):
+    """Re-run only the categories and lookups that failed in a scrape job"""
+    if task_id in scrape_jobs:
+        failed_requests = scrape_jobs[task_id].get("failed_requests", [])
+    else:
+        # Job status is in-memory, but each job's failures are persisted, so a restart doesn't lose them
+        failed_requests = load_retry_queue(job_retry_queue_path(task_id))
+        if not failed_requests:
+            raise HTTPException(status_code=404, detail="Job not found")
+    
+    busy = running_job()
+    if busy:
+        raise HTTPException(status_code=409, detail=f"Scrape job {busy} is still running")
+    
+    allowed, message = within_crawl_window()
+    if not allowed:
+        raise HTTPException(
+            status_code=423,
+            detail=f"Scraping not allowed: {message}"
+        )
+    
+    queue = [entry for entry in failed_requests if not entry.get("exhausted")]
+    if not queue:
+        raise HTTPException(status_code=404, detail="No failed requests to retry for this job")
+    
+    retry_task_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_retry"
+    
+    scrape_jobs[retry_task_id] = {
+        "status": "running",
+        "start_time": datetime.now().isoformat(),
+        "products_scraped": 0,
+        "retry_of": task_id,
+        "retrying": len(queue)
+    }
+    
+    background_tasks.add_task(run_scrapy_spider, retry_task_id, job_retry_queue_path(task_id))
+    
+    return ScrapeResponse(
+        status="started",
+        message=f"Retrying {len(queue)} failed requests from job {task_id}",
+        task_id=retry_task_id,
+        timestamp=datetime.now().isoformat()
+    )
+
 @app.get("/scrape/results")
 async def get_scrape_results():
     """Get the latest scrape results"""
@@ -103,11 +164,46 @@ async def get_scrape_results():
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="No results found. Run scraper first.")
 
-async def run_scrapy_spider(task_id: str):
+@app.get("/scrape/changes")
+async def get_scrape_changes(since: int = 0, wait: int = 0, limit: int = 500):
+    """Get price changes recorded after the `since` cursor, optionally long-polling up to `wait` seconds"""
+    if limit <= 0:
+        raise HTTPException(status_code=422, detail="limit must be a positive integer")
+    
+    # A cursor past the end means the log was replaced, so the client has to start over
+    if since > last_cursor():
+        raise HTTPException(
+            status_code=410,
+            detail=f"Cursor {since} is ahead of the change log (latest: {last_cursor()}). Resync with since=0."
+        )
+    
+    wait = max(0, min(wait, 60))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+
+    changes = read_changes(since, limit)
+    # The crawl runs in a subprocess, so poll the change log until something new lands
+    while not changes and loop.time() < deadline:
+        await asyncio.sleep(1)
+        if last_cursor() > since:
+            changes = read_changes(since, limit)
+
+    cursor = changes[-1]["seq"] if changes else since
+    return {
+        "cursor": cursor,
+        "count": len(changes),
+        "changes": changes
+    }
+
+async def run_scrapy_spider(task_id: str, retry_queue: Optional[str] = None):
     """Run the Scrapy spider in a subprocess"""
     try:
+        # Each job writes its own failures so a later retry re-runs exactly those
+        args = ['run_scraper.py', '--failures', job_retry_queue_path(task_id)]
+        if retry_queue:
+            args += ['--retry', retry_queue]
         process = await asyncio.create_subprocess_exec(
-            'python', 'run_scraper.py',
+            'python', *args,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
@@ -123,6 +219,7 @@ async def run_scrapy_spider(task_id: str):
                     scrape_jobs[task_id]["products_scraped"] = len(products)
             except:
                 scrape_jobs[task_id]["products_scraped"] = 0
+            scrape_jobs[task_id]["failed_requests"] = load_retry_queue(job_retry_queue_path(task_id))
         else:
             scrape_jobs[task_id]["status"] = "failed"
             scrape_jobs[task_id]["error"] = stderr.decode()
@@ -1,5 +1,6 @@
 import os
 import sys
+import argparse
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
 
@@ -8,10 +9,18 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from spiders.picknpay_spider import PicknPaySpider
 from utils.time_checker import within_crawl_window
+from utils.retry_queue import RETRY_QUEUE_FILE
 
 def main():
     """Main function to run the scraper"""
     
+    parser = argparse.ArgumentParser(description="Run the Pick n Pay scraper")
+    parser.add_argument('--retry', metavar='QUEUE_FILE',
+                        help="re-run only the failed requests listed in this retry queue file")
+    parser.add_argument('--failures', metavar='QUEUE_FILE', default=RETRY_QUEUE_FILE,
+                        help="where to save requests that still fail (default: %(default)s)")
+    args = parser.parse_args()
+    
     # Check if within crawl window
     allowed, message = within_crawl_window()
     
@@ -50,8 +59,11 @@ def main():
     settings = get_project_settings()
     process = CrawlerProcess(settings)
     
-    print("🚀 Starting Pick n Pay spider...")
-    process.crawl(PicknPaySpider)
+    if args.retry:
+        print("🔁 Retrying only failed categories and lookups...")
+    else:
+        print("🚀 Starting Pick n Pay spider...")
+    process.crawl(PicknPaySpider, retry_queue=args.retry, failures_file=args.failures)
     process.start()
     
     print("✅ Scraping completed!")
@@ -24,6 +24,12 @@ AUTOTHROTTLE_START_DELAY = 10
 AUTOTHROTTLE_MAX_DELAY = 15
 AUTOTHROTTLE_TARGET_CONCURRENCY = 0.5
 
+# Targeted retries for failed category renders (exponential backoff with jitter)
+RETRY_QUEUE_MAX_ATTEMPTS = 3
+RETRY_QUEUE_BASE_DELAY = 30  # seconds
+RETRY_QUEUE_MAX_DELAY = 300  # seconds
+RETRY_QUEUE_MAX_RUNS = 3  # crawls an entry may fail in before it is no longer retried
+
 # Respect robots.txt
 ROBOTSTXT_OBEY = True
 
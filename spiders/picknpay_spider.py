@@ -1,30 +1,62 @@
 import scrapy
 import json
 import pytz
+import asyncio
 from datetime import datetime
 from scrapy_playwright.page import PageMethod
-from urllib.parse import urljoin
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from urllib.parse import urljoin, quote
 import logging
 import re
 
+from utils.price_changes import index_products, diff_products, load_snapshot, append_changes
+from utils.retry_queue import RETRY_QUEUE_FILE, load_retry_queue, save_retry_queue, make_retry_entry, backoff_delay
+from utils.time_checker import seconds_until_window_close
+
 class JsonWriterPipeline:
     def open_spider(self, spider):
-        self.file = open('data/products.json', 'w', encoding='utf-8')
-        self.file.write('[\n')
-        self.first_item = True
+        # Index the previous snapshot before it gets overwritten so we can diff against it
+        self.previous_products = load_snapshot('data/products.json')
+        self.previous_index = index_products(self.previous_products)
+
+        # Retry runs only re-crawl failed categories, so their items are merged into the last snapshot
+        self.merge = getattr(spider, 'retry_failed', False)
+        self.current_index = dict(self.previous_index) if self.merge else {}
+
+        # The snapshot is only written on close, so an aborted crawl leaves it alone
+        self.items = []
 
     def close_spider(self, spider):
-        self.file.write('\n]')
-        self.file.close()
+        if not getattr(spider, 'crawl_started', True) or not self.items:
+            spider.logger.warning("⚠️ No products scraped, keeping the previous snapshot")
+            return
 
-    def process_item(self, item, spider):
-        if not self.first_item:
-            self.file.write(',\n')
+        if self.merge:
+            products = [p for p in self.previous_products if not p.get('product_id')]
+            products += list(self.current_index.values())
         else:
-            self.first_item = False
-        
-        line = json.dumps(dict(item), ensure_ascii=False, indent=2)
-        self.file.write(line)
+            # Products from categories that failed to render are missing, not removed, so keep the last good data
+            failed_urls = {
+                entry['url'] for entry in getattr(spider, 'failed_requests', {}).values()
+                if entry.get('kind') == 'category'
+            }
+            products = list(self.items)
+            for product_id, item in self.previous_index.items():
+                if product_id not in self.current_index and item.get('category_url') in failed_urls:
+                    self.current_index[product_id] = item
+                    products.append(item)
+
+        with open('data/products.json', 'w', encoding='utf-8') as f:
+            json.dump(products, f, ensure_ascii=False, indent=2)
+
+        changes = diff_products(self.previous_index, self.current_index)
+        cursor = append_changes(changes)
+        spider.logger.info(f"🔄 Recorded {len(changes)} changes (cursor: {cursor})")
+
+    def process_item(self, item, spider):
+        self.items.append(dict(item))
+        if item.get('product_id'):
+            self.current_index[item['product_id']] = dict(item)
         return item
 
 class PicknPaySpider(scrapy.Spider):
@@ -37,10 +69,17 @@ class PicknPaySpider(scrapy.Spider):
         'ROBOTSTXT_OBEY': True,
     }
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, retry_queue=None, failures_file=RETRY_QUEUE_FILE, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.utc_tz = pytz.utc
         
+        # When set, only the requests in this retry queue file are crawled
+        self.retry_queue = retry_queue
+        self.retry_failed = bool(retry_queue)
+        self.failures_file = failures_file
+        self.failed_requests = {}
+        self.crawl_started = False
+        
         # List of REQUIRED products to look for
         self.required_products = [
             # Groceries
@@ -145,6 +184,12 @@ class PicknPaySpider(scrapy.Spider):
             return
         
         self.logger.info("✅ Within crawling window, starting scrape...")
+        self.crawl_started = True
+        
+        if self.retry_failed:
+            yield from self.retry_requests()
+            return
+        
         self.logger.info(f"🎯 Looking for {len(self.required_products)} specific products")
         
         # Group products by category to minimize requests
@@ -165,28 +210,82 @@ class PicknPaySpider(scrapy.Spider):
             self.logger.info(f"📦 Queueing: {cat_info['main_category']}")
             self.logger.info(f"   Looking for: {', '.join(cat_info['products'][:3])}{'...' if len(cat_info['products']) > 3 else ''}")
             
-            yield scrapy.Request(
-                url=cat_url,
-                callback=self.parse_category,
-                meta={
-                    'playwright': True,
-                    'playwright_page_methods': [
-                        PageMethod('wait_for_selector', 'div.product-grid-item', timeout=40000),
-                        PageMethod('wait_for_timeout', 8000),
-                    ],
-                    'download_delay': 10.0,
-                    'main_category': cat_info['main_category'],
-                    'sub_category': cat_info['sub_category'],
-                    'target_products': cat_info['products']
-                },
-                errback=self.errback,
-            )
+            yield self.category_request(cat_url, cat_info['main_category'], cat_info['sub_category'], cat_info['products'])
+    
+    def retry_requests(self):
+        """Rebuild requests for everything in the given retry queue file"""
+        queue = load_retry_queue(self.retry_queue)
+        max_runs = self.settings.getint('RETRY_QUEUE_MAX_RUNS', 3)
+        self.logger.info(f"🔁 Retrying {len(queue)} queued requests")
+        
+        for entry in queue:
+            if entry.get('exhausted') or entry.get('runs', 0) >= max_runs:
+                # Keep it visible in the job's failures, but stop spending renders on it
+                self.logger.warning(f"⏭️ Giving up on {entry['url']} after {entry.get('runs', 0)} runs")
+                self.failed_requests[entry['url']] = {**entry, 'exhausted': True}
+                continue
+            
+            if entry['kind'] == 'lookup':
+                request = self.lookup_request(entry['target_products'][0], entry['main_category'],
+                                              entry['sub_category'], entry.get('category_url'))
+            else:
+                request = self.category_request(entry['url'], entry['main_category'],
+                                                entry['sub_category'], entry['target_products'])
+            request.meta['queued_runs'] = entry.get('runs', 0)
+            request.meta['dont_cache'] = True
+            yield request
+    
+    def category_request(self, cat_url, main_category, sub_category, target_products):
+        """Build a full Playwright render request for a category page"""
+        return scrapy.Request(
+            url=cat_url,
+            callback=self.parse_category,
+            meta={
+                'playwright': True,
+                'playwright_page_methods': [
+                    PageMethod('wait_for_selector', 'div.product-grid-item', timeout=40000),
+                    PageMethod('wait_for_timeout', 8000),
+                ],
+                'download_delay': 10.0,
+                'main_category': main_category,
+                'sub_category': sub_category,
+                'target_products': target_products
+            },
+            errback=self.errback,
+            dont_filter=True,
+        )
+    
+    def lookup_request(self, target_name, main_category, sub_category, category_url=None):
+        """Build a cheaper search request for a single product missing from its category"""
+        # A free-text query only renders a handful of results, so no settle wait is needed
+        lookup_url = f"https://www.pnp.co.za/c/pnpbase?query={quote(target_name)}:relevance:allCategories:pnpbase"
+        return scrapy.Request(
+            url=lookup_url,
+            callback=self.parse_category,
+            meta={
+                'playwright': True,
+                'playwright_page_methods': [
+                    PageMethod('wait_for_selector', 'div.product-grid-item', timeout=15000),
+                ],
+                'download_delay': 10.0,
+                'main_category': main_category,
+                'sub_category': sub_category,
+                'target_products': [target_name],
+                'category_url': category_url,
+                'lookup': True,
+                # A cached "not found" page would make every retry within the hour a no-op
+                'dont_cache': True
+            },
+            errback=self.errback,
+            dont_filter=True,
+        )
     
     def parse_category(self, response):
         """Parse category page and look for specific products"""
         main_category = response.meta.get('main_category', 'Unknown')
         sub_category = response.meta.get('sub_category', 'Unknown')
         target_products = response.meta.get('target_products', [])
+        is_lookup = response.meta.get('lookup', False)
         
         self.logger.info(f"📁 Processing: {main_category} > {sub_category}")
         self.logger.info(f"🎯 Looking for: {target_products}")
@@ -228,9 +327,14 @@ class PicknPaySpider(scrapy.Spider):
             
             if not found:
                 self.logger.warning(f"⚠️ Not found: {target_name}")
+                if is_lookup:
+                    self.record_failure(response.request, 'Not found')
+                else:
+                    self.logger.info(f"🔎 Queueing lookup for: {target_name}")
+                    yield self.lookup_request(target_name, main_category, sub_category, response.url)
         
         # If we didn't find all products, collect some other products from the category
-        if len(found_products) < len(target_products):
+        if len(found_products) < len(target_products) and not is_lookup:
             self.logger.info(f"🔍 Only found {len(found_products)}/{len(target_products)} required products")
             self.logger.info("🔍 Collecting additional products from category...")
             
@@ -251,6 +355,8 @@ class PicknPaySpider(scrapy.Spider):
                 if name and not any(name.lower() == item['name'].lower() for item in found_products):
                     item = self.extract_product_data(product, response, main_category, sub_category, name)
                     if item:
+                        # Extras only show up when a target is missing, so they are kept out of new/removed diffs
+                        item['additional'] = True
                         found_products.append(item)
                         additional_count += 1
                         self.logger.info(f"➕ Additional product: {name} - {item['price']}")
@@ -311,7 +417,7 @@ class PicknPaySpider(scrapy.Spider):
             'product_id': product_id,
             'main_category': main_category,
             'sub_category': sub_category,
-            'category_url': response.url,
+            'category_url': response.meta.get('category_url') or response.url,
             'scraped_at': datetime.now(self.utc_tz).isoformat(),
             'data_attributes': {
                 'item_id': product_id,
@@ -340,5 +446,52 @@ class PicknPaySpider(scrapy.Spider):
         return None
     
     async def errback(self, failure):
-        """Handle request errors"""
-        self.logger.error(f"❌ Request failed: {failure.value}")
\ No newline at end of file
+        """Handle request errors, retrying with backoff while the crawl window allows"""
+        request = failure.request
+        main_category = request.meta.get('main_category', 'Unknown')
+        
+        if request.meta.get('lookup'):
+            # An empty search result never renders the grid, so a timeout means the product is gone
+            target_name = request.meta.get('target_products', ['Unknown'])[0]
+            if failure.check(PlaywrightTimeoutError):
+                self.logger.warning(f"⚠️ Not found: {target_name}")
+                self.record_failure(request, 'Not found')
+            else:
+                self.logger.error(f"❌ Lookup failed: {failure.value}")
+                self.record_failure(request, str(failure.value))
+            return []
+        
+        self.logger.error(f"❌ Request failed: {failure.value}")
+        attempt = request.meta.get('retry_attempt', 0)
+        max_attempts = self.settings.getint('RETRY_QUEUE_MAX_ATTEMPTS', 3)
+        delay = backoff_delay(
+            attempt,
+            self.settings.getfloat('RETRY_QUEUE_BASE_DELAY', 30),
+            self.settings.getfloat('RETRY_QUEUE_MAX_DELAY', 300),
+        )
+        
+        if attempt + 1 < max_attempts and delay < seconds_until_window_close():
+            self.logger.info(f"🔁 Retrying {main_category} in {delay:.0f}s (attempt {attempt + 2}/{max_attempts})")
+            await asyncio.sleep(delay)
+            return [request.replace(meta={**request.meta, 'retry_attempt': attempt + 1})]
+        
+        self.logger.warning(f"📥 Saving {main_category} to the retry queue")
+        self.record_failure(request, str(failure.value))
+        return []
+    
+    def record_failure(self, request, error):
+        """Remember a failed request so it can be retried in a later run"""
+        kind = 'lookup' if request.meta.get('lookup') else 'category'
+        entry = make_retry_entry(kind, request.url, request.meta, error)
+        entry['exhausted'] = entry['runs'] >= self.settings.getint('RETRY_QUEUE_MAX_RUNS', 3)
+        if kind == 'lookup':
+            entry['category_url'] = request.meta.get('category_url')
+        self.failed_requests[request.url] = entry
+    
+    def closed(self, reason):
+        """Persist this run's failures so the job that ran them can retry them"""
+        if not self.crawl_started:
+            return
+        save_retry_queue(list(self.failed_requests.values()), self.failures_file)
+        if self.failed_requests:
+            self.logger.warning(f"📥 {len(self.failed_requests)} requests saved for retry")
\ No newline at end of file
@@ -0,0 +1,176 @@
+import json
+import os
+import re
+from datetime import datetime
+import pytz
+
+CHANGES_FILE = 'data/changes.jsonl'
+
+def parse_price(value):
+    """Turn a price string like 'R 99.99' or '99.99' into a float"""
+    if not value:
+        return None
+    numbers = re.findall(r'\d+\.?\d*', str(value).replace(',', ''))
+    if not numbers:
+        return None
+    return float(numbers[0])
+
+def index_products(products):
+    """Build a product_id -> product index, skipping items without an id"""
+    return {p['product_id']: p for p in products if p.get('product_id')}
+
+def diff_products(previous, current):
+    """Compare two product_id indexes and return a list of change records"""
+    changes = []
+
+    for product_id, item in current.items():
+        old = previous.get(product_id)
+        if old is None:
+            # Additional (non-target) products come and go with the targets, so they are never "new"
+            if not item.get('additional'):
+                changes.append(_change('new', item, None))
+            continue
+
+        old_price = parse_price(old.get('price_value'))
+        new_price = parse_price(item.get('price_value'))
+        if old_price is not None and new_price is not None:
+            if new_price > old_price:
+                changes.append(_change('price_up', item, old))
+            elif new_price < old_price:
+                changes.append(_change('price_down', item, old))
+
+        # A product is on sale when the site shows an original (struck-out) price
+        was_on_sale = bool(old.get('original_price'))
+        is_on_sale = bool(item.get('original_price'))
+        if is_on_sale and not was_on_sale:
+            changes.append(_change('sale_start', item, old))
+        elif was_on_sale and not is_on_sale:
+            changes.append(_change('sale_end', item, old))
+
+    for product_id, old in previous.items():
+        if product_id not in current and not old.get('additional'):
+            changes.append(_change('removed', None, old))
+
+    return changes
+
+def _change(change_type, item, old):
+    """Build a compact change record"""
+    source = item or old
+    return {
+        'type': change_type,
+        'product_id': source.get('product_id'),
+        'name': source.get('name'),
+        'old_price': old.get('price_value') if old else None,
+        'new_price': item.get('price_value') if item else None,
+        'old_original_price': old.get('original_price') if old else None,
+        'new_original_price': item.get('original_price') if item else None,
+    }
+
+def load_snapshot(path):
+    """Load a products snapshot, returning an empty list if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+# Byte offset of every record by seq, extended incrementally so each poll only reads new bytes
+_offset_index = {}
+
+def _refresh_index(path):
+    """Index any complete records appended to the log since the last call"""
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        _offset_index.pop(path, None)
+        return None
+
+    index = _offset_index.get(path)
+    if index is None or size < index['scanned']:
+        # First read, or the log was replaced: start over
+        index = {'offsets': {}, 'scanned': 0, 'last_seq': 0}
+        _offset_index[path] = index
+    if size == index['scanned']:
+        return index
+
+    with open(path, 'rb') as f:
+        f.seek(index['scanned'])
+        position = index['scanned']
+        for line in f:
+            # A line without a newline is still being written by the crawl
+            if not line.endswith(b'\n'):
+                break
+            if line.strip():
+                try:
+                    seq = json.loads(line)['seq']
+                    index['offsets'][seq] = position
+                    index['last_seq'] = max(index['last_seq'], seq)
+                except (json.JSONDecodeError, KeyError):
+                    pass
+            position += len(line)
+    index['scanned'] = position
+    return index
+
+def last_cursor(path=CHANGES_FILE):
+    """Return the sequence number of the newest change in the log (0 if empty)"""
+    index = _refresh_index(path)
+    return index['last_seq'] if index else 0
+
+def append_changes(changes, path=CHANGES_FILE):
+    """Append change records to the log, numbering them after the current cursor"""
+    index = _refresh_index(path)
+    seq = index['last_seq'] if index else 0
+    if not changes:
+        return seq
+
+    if index and os.path.getsize(path) > index['scanned']:
+        # Drop a torn trailing line left by an interrupted write so new records start on a fresh line
+        with open(path, 'r+b') as f:
+            f.truncate(index['scanned'])
+
+    timestamp = datetime.now(pytz.utc).isoformat()
+    lines = []
+    for change in changes:
+        seq += 1
+        record = {'seq': seq, 'detected_at': timestamp, **change}
+        lines.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    # One write per crawl so pollers never see records interleaved with a half-flushed buffer
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return seq
+
+def read_changes(since=0, limit=None, path=CHANGES_FILE):
+    """Return change records with a sequence number greater than `since`"""
+    if limit is not None and limit <= 0:
+        raise ValueError("limit must be a positive integer")
+
+    index = _refresh_index(path)
+    if not index or index['last_seq'] <= since:
+        return []
+
+    # seq is dense, so the first record after the cursor is usually since + 1
+    seq = max(since + 1, 1)
+    while seq not in index['offsets'] and seq <= index['last_seq']:
+        seq += 1
+    if seq not in index['offsets']:
+        return []
+
+    changes = []
+    with open(path, 'rb') as f:
+        f.seek(index['offsets'][seq])
+        position = f.tell()
+        for line in f:
+            if position >= index['scanned']:
+                break
+            position += len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('seq', 0) <= since:
+                continue
+            changes.append(record)
+            if limit and len(changes) >= limit:
+                break
+    return changes
@@ -0,0 +1,40 @@
+import json
+import random
+from datetime import datetime
+import pytz
+
+RETRY_QUEUE_FILE = 'data/retry_queue.json'
+
+def job_retry_queue_path(task_id):
+    """Path of the failures file written by a single scrape job"""
+    return f'data/retry_queue_{task_id}.json'
+
+def load_retry_queue(path=RETRY_QUEUE_FILE):
+    """Load queued failed requests, returning an empty list if there are none"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+def save_retry_queue(entries, path=RETRY_QUEUE_FILE):
+    """Persist failed requests so a later run can retry only those"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+
+def make_retry_entry(kind, url, meta, error):
+    """Build a queue entry from a failed request's meta"""
+    return {
+        'kind': kind,
+        'url': url,
+        'main_category': meta.get('main_category', 'Unknown'),
+        'sub_category': meta.get('sub_category', 'Unknown'),
+        'target_products': meta.get('target_products', []),
+        'runs': meta.get('queued_runs', 0) + 1,
+        'last_error': error,
+        'failed_at': datetime.now(pytz.utc).isoformat()
+    }
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter for the given (zero-based) attempt"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
@@ -14,6 +14,15 @@ def within_crawl_window():
         return False, f"Outside crawling hours. Current UTC: {utc_now.strftime('%H:%M')}"
     return True, f"Within allowed window. Current UTC: {utc_now.strftime('%H:%M')}"
 
+def seconds_until_window_close():
+    """Seconds left before the 08:45 UTC window close (0 if outside the window)"""
+    allowed, _ = within_crawl_window()
+    if not allowed:
+        return 0
+    utc_now = datetime.now(pytz.utc)
+    close = utc_now.replace(hour=8, minute=45, second=59, microsecond=0)
+    return max(0, (close - utc_now).total_seconds())
+
 def get_crawl_window_info():
     """Get information about the crawl window"""
     allowed, message = within_crawl_window()